@@ -2,17 +2,29 @@ import telegram
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.triggers.cron import CronTrigger
-import pytz
-from collections import defaultdict, deque
+from collections import defaultdict, deque, Counter, OrderedDict
+from array import array
 from datetime import datetime, timedelta, time
+from zoneinfo import ZoneInfo
+from time import monotonic
 import random
+import bisect
+import heapq
 import logging
 import asyncio
+import concurrent.futures
 import pickle
+import pickletools
+import zlib
+import json
+import hmac
+import hashlib
 import os
 import sys
+import functools
+from dataclasses import dataclass
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,6 +36,7 @@ TOKEN = os.getenv('TELEGRAM_TOKEN')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 GROUP_CHAT_ID = os.getenv('GROUP_CHAT_ID')
 PASSWORD = os.getenv('PASSWORD', 'shoebot123')  # Default password or fetch from env if needed
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', '32'))
 
 # Check if required environment variables are set
 if not TOKEN:
@@ -35,117 +48,439 @@ if not ADMIN_CHAT_ID:
 if not GROUP_CHAT_ID:
     logger.error("GROUP_CHAT_ID environment variable is not set.")
     sys.exit(1)
+# Telegram ids arrive as ints, so compare against ints instead of str()-ing every user id
+ADMIN_ID = int(ADMIN_CHAT_ID)
+GROUP_ID = int(GROUP_CHAT_ID)
+
+# State files are HMAC-signed so a tampered pickle is rejected before it is unpickled
+STATE_HMAC_KEY = os.getenv('STATE_HMAC_KEY')
+if not STATE_HMAC_KEY:
+    logger.error("STATE_HMAC_KEY environment variable is not set.")
+    sys.exit(1)
+STATE_HMAC_KEY = STATE_HMAC_KEY.encode()
+ALLOW_UNSIGNED_STATE = os.getenv('ALLOW_UNSIGNED_STATE') == '1'  # One-off migration of pre-HMAC state files
 
 # Constants
-TIMEZONE = pytz.timezone('Europe/Vilnius')
+TIMEZONE = ZoneInfo('Europe/Vilnius')
+_MIN_DT = datetime.min.replace(tzinfo=TIMEZONE)
+_WEEK = timedelta(days=7)
+_MONTH = timedelta(days=30)
+_ZERO = timedelta(0)
+_HISTORY_RETENTION = timedelta(days=90)
+_VOTE_COOLDOWN = _WEEK
+_DOWNVOTE_COOLDOWN = _WEEK
 COINFLIP_STICKER_ID = 'CAACAgIAAxkBAAEN32tnuPb-ovynJR5WNO1TQyv_ea17DwAC-RkAAtswEEqAzfrZRd8B1zYE'
 
 # Data loading and saving functions
-def load_data(filename, default):
+def _sign(payload):
+    return hmac.new(STATE_HMAC_KEY, payload, hashlib.sha256).digest() + payload
+
+# save_as is the file the data now lives in; unsigned or legacy loads mark it dirty so the first flush rewrites it signed
+def load_data(filename, default, save_as=None):
+    save_as = save_as or filename
     try:
         if os.path.exists(filename) and os.path.getsize(filename) > 0:
             with open(filename, 'rb') as f:
-                return pickle.load(f)
+                blob = f.read()
+            mac, payload = blob[:32], blob[32:]
+            if hmac.compare_digest(mac, hmac.new(STATE_HMAC_KEY, payload, hashlib.sha256).digest()):
+                if payload[:1] == b'\x78':  # zlib header; uncompressed pickles start with b'\x80'
+                    payload = zlib.decompress(payload)
+                data = pickle.loads(payload)
+                if save_as != filename:
+                    mark_dirty(save_as)
+                return data
+            if ALLOW_UNSIGNED_STATE:
+                logger.warning(f"Loading unsigned state from {filename}")
+                data = pickle.loads(blob)
+                mark_dirty(save_as)
+                return data
+            # Refuse to start rather than fall back to the default, which the flusher would write over the real file
+            logger.error(f"Rejected {filename}: HMAC signature mismatch; set ALLOW_UNSIGNED_STATE=1 to migrate it")
+            sys.exit(1)
         return default
-    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, zlib.error):
         return default
 
-def save_data(data, filename):
+# Plain {int: int} counters and scalar settings are stored as JSON; legacy_filename is the pickle they were migrated from
+def load_json(filename, default, legacy_filename=None, int_keys=True):
+    try:
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'rb') as f:
+                data = json.load(f)
+            return {int(k): v for k, v in data.items()} if int_keys else data
+    except (OSError, ValueError) as e:
+        # Same as a MAC mismatch: a default returned here would be flushed over the unreadable file
+        logger.error(f"Failed to load {filename}: {str(e)}")
+        sys.exit(1)
+    if legacy_filename:
+        return load_data(legacy_filename, default, save_as=filename)
+    return default
+
+def _encode(data, filename):
     if isinstance(data, defaultdict):
         data = dict(data)
+    if filename.endswith('.json'):
+        return json.dumps(data, separators=(',', ':')).encode()
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _write_atomic(filename, payload):
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'wb', buffering=1 << 20) as f:
+        f.write(payload)
+        # Make the data durable before the rename, otherwise a crash can leave an empty file that loads as the default
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+# Runs off the event loop: the CPU-heavy pickle optimization, compression and signing happen on already-serialized bytes
+def _write_state(filename, payload):
+    if not filename.endswith('.json'):
+        payload = _sign(zlib.compress(pickletools.optimize(payload)))
+    _write_atomic(filename, payload)
+
+# Debounced persistence: handlers only mark files dirty, flusher() writes them at most once per second
+_dirty = set()
+_save_registry = {}
+_flush_lock = asyncio.Lock()
+_file_locks = defaultdict(asyncio.Lock)  # One writer per file, otherwise two saves would race on the same .tmp
+_io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix='bot-io')  # Also the loop's default executor
+
+def mark_dirty(*filenames):
+    _dirty.update(filenames)
+
+# Chat counters change on every message, so they are only marked dirty every 50 messages or 30 seconds
+_MESSAGE_STATE_FILES = ('alltime_messages.json', 'chat_streaks.json', 'last_chat_day.pkl')
+_msgs_since_save = 0
+_last_msg_save = monotonic()
+
+def mark_messages_dirty():
+    global _msgs_since_save, _last_msg_save
+    mark_dirty(*_MESSAGE_STATE_FILES)
+    _msgs_since_save = 0
+    _last_msg_save = monotonic()
+
+async def asave(data, filename):
     try:
-        with open(filename, 'wb') as f:
-            pickle.dump(data, f)
+        # Serialize on the loop thread so handlers can't mutate the data mid-dump; only the disk write is offloaded
+        payload = _encode(data, filename)
+        async with _file_locks[filename]:
+            await asyncio.get_running_loop().run_in_executor(_io_executor, _write_state, filename, payload)
         logger.info(f"Saved data to {filename}")
+        return True
     except Exception as e:
         logger.error(f"Failed to save {filename}: {str(e)}")
+        return False
+
+async def flush_dirty():
+    async with _flush_lock:
+        pending = list(_dirty)
+        _dirty.clear()
+        for filename in pending:
+            if not await asave(_save_registry[filename](), filename):
+                _dirty.add(filename)
+
+async def flusher():
+    while True:
+        await asyncio.sleep(1)
+        if _msgs_since_save and monotonic() - _last_msg_save > 30:
+            mark_messages_dirty()
+        if _dirty:
+            await flush_dirty()
 
 # Load initial data
-featured_media_id = load_data('featured_media_id.pkl', None)
-featured_media_type = load_data('featured_media_type.pkl', None)
-barygos_media_id = load_data('barygos_media_id.pkl', None)
-barygos_media_type = load_data('barygos_media_type.pkl', None)
+featured_media_id = load_json('featured_media_id.json', None, 'featured_media_id.pkl', int_keys=False)
+featured_media_type = load_json('featured_media_type.json', None, 'featured_media_type.pkl', int_keys=False)
+barygos_media_id = load_json('barygos_media_id.json', None, 'barygos_media_id.pkl', int_keys=False)
+barygos_media_type = load_json('barygos_media_type.json', None, 'barygos_media_type.pkl', int_keys=False)
 
-PARDAVEJAI_MESSAGE_FILE = 'pardavejai_message.pkl'
+PARDAVEJAI_MESSAGE_FILE = 'pardavejai_message.json'
 DEFAULT_PARDAVEJAI_MESSAGE = "Pasirink pardavėją, už kurį nori balsuoti iš žemiau esančių mygtukų:"
-pardavejai_message = load_data(PARDAVEJAI_MESSAGE_FILE, DEFAULT_PARDAVEJAI_MESSAGE)
+pardavejai_message = load_json(PARDAVEJAI_MESSAGE_FILE, DEFAULT_PARDAVEJAI_MESSAGE, 'pardavejai_message.pkl', int_keys=False)
 last_addftbaryga_message = None
 last_addftbaryga2_message = None
 
-def save_pardavejai_message():
-    save_data(pardavejai_message, PARDAVEJAI_MESSAGE_FILE)
-
 # Scheduler setup
 scheduler = AsyncIOScheduler(timezone=TIMEZONE)
-scheduler.add_executor(ThreadPoolExecutor(max_workers=10), alias='default')
+scheduler.add_executor(AsyncIOExecutor(), alias='default')
+_flusher_task = None
 
 async def configure_scheduler(application):
     logger.info("Configuring scheduler...")
+    asyncio.get_running_loop().set_default_executor(_io_executor)
     application.job_queue.scheduler = scheduler
     scheduler.start()
+    schedule_jobs(application)
     logger.info("Scheduler started successfully.")
+    global _flusher_task
+    _flusher_task = asyncio.get_running_loop().create_task(flusher())
+    logger.info("State flusher started.")
+
+async def shutdown_flush(application):
+    if _msgs_since_save:
+        mark_messages_dirty()
+    await flush_dirty()
+    if _flusher_task:
+        _flusher_task.cancel()
+    logger.info("State flushed on shutdown.")
+
+# Compact per-seller vote log: parallel arrays instead of a (user_id, kind, reason, datetime) tuple per vote
+class VoteHistory:
+    __slots__ = ('user_ids', 'signs', 'reasons', 'timestamps')
+
+    def __init__(self, entries=()):
+        self.user_ids = array('q')
+        self.signs = array('B')  # 1 = up, 0 = down
+        self.reasons = []
+        self.timestamps = array('d')  # Unix seconds
+        for user_id, kind, reason, ts in entries:
+            self.add(user_id, kind, reason, ts)
+
+    def add(self, user_id, kind, reason, ts):
+        self.user_ids.append(user_id)
+        self.signs.append(1 if kind == "up" else 0)
+        self.reasons.append(reason)
+        self.timestamps.append(ts.timestamp())
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    # Entries are appended in time order, so everything older than cutoff is a prefix
+    def prune(self, cutoff):
+        i = bisect.bisect_left(self.timestamps, cutoff.timestamp())
+        if i:
+            del self.user_ids[:i], self.signs[:i], self.reasons[:i], self.timestamps[:i]
+        return i > 0
+
+    def __getstate__(self):
+        return self.user_ids, self.signs, self.reasons, self.timestamps
+
+    def __setstate__(self, state):
+        self.user_ids, self.signs, self.reasons, self.timestamps = state
+
+@dataclass(slots=True)
+class Complaint:
+    vendor: str
+    user_id: int
+    reason: str
+    ts: datetime
 
 # Bot initialization
-application = Application.builder().token(TOKEN).post_init(configure_scheduler).build()
+application = Application.builder().token(TOKEN).concurrent_updates(True).post_init(configure_scheduler).post_shutdown(shutdown_flush).build()
 logger.info("Bot initialized")
 
 # Data structures
-trusted_sellers = ['@Seller1', '@Seller2', '@Seller3']
-votes_weekly = load_data('votes_weekly.pkl', defaultdict(int))
-votes_monthly = load_data('votes_monthly.pkl', defaultdict(list))
-votes_alltime = load_data('votes_alltime.pkl', defaultdict(int))
-voters = set()
-downvoters = set()
+trusted_sellers = dict.fromkeys(['@Seller1', '@Seller2', '@Seller3'])  # Insertion-ordered, O(1) membership
+_lower_to_seller = {seller.lower(): seller for seller in trusted_sellers}  # Telegram tags are case-insensitive
+votes_weekly = defaultdict(int, load_data('votes_weekly.pkl', {}))
+votes_monthly = defaultdict(deque, {vendor: deque(sorted(entries)) for vendor, entries in load_data('votes_monthly.pkl', {}).items()})
+monthly_totals = defaultdict(int)
+votes_alltime = defaultdict(int, load_data('votes_alltime.pkl', {}))
 pending_downvotes = {}
 approved_downvotes = {}
-vote_history = load_data('vote_history.pkl', defaultdict(list))
-last_vote_attempt = defaultdict(lambda: datetime.min.replace(tzinfo=TIMEZONE))
-last_downvote_attempt = defaultdict(lambda: datetime.min.replace(tzinfo=TIMEZONE))
+vote_history = defaultdict(VoteHistory, {
+    vendor: history if isinstance(history, VoteHistory) else VoteHistory(history)  # Migrate legacy list-of-tuples pickles
+    for vendor, history in load_data('vote_history.pkl', {}).items()
+})
+last_vote_attempt = {}
+last_downvote_attempt = {}
 complaint_id = 0
-user_points = load_data('user_points.pkl', defaultdict(int))
-coinflip_challenges = {}
-daily_messages = defaultdict(lambda: defaultdict(int))
+user_points = defaultdict(int, load_json('user_points.json', {}, 'user_points.pkl'))
+coinflip_challenges = OrderedDict()  # Insertion order == creation order, so the oldest challenge is always first
+today_msgs = Counter()  # Per-user message counts for current_msg_date
+yesterday_msgs = Counter()  # Previous day's counts, consumed by award_daily_points
+current_msg_date = datetime.now(TIMEZONE).date()
 weekly_messages = defaultdict(int)
-alltime_messages = load_data('alltime_messages.pkl', defaultdict(int))
-chat_streaks = load_data('chat_streaks.pkl', defaultdict(int))
-last_chat_day_raw = load_data('last_chat_day.pkl', {})
-last_chat_day = defaultdict(lambda: datetime.min.replace(tzinfo=TIMEZONE), last_chat_day_raw)
-allowed_groups = {GROUP_CHAT_ID}
+alltime_messages = defaultdict(int, load_json('alltime_messages.json', {}, 'alltime_messages.pkl'))
+chat_streaks = defaultdict(int, load_json('chat_streaks.json', {}, 'chat_streaks.pkl'))
+last_chat_day = load_data('last_chat_day.pkl', {})
+allowed_groups = {GROUP_ID}
+allowed_chats_filter = filters.Chat(chat_id=GROUP_ID)  # Lets PTB drop chatter from other chats before handle_message runs
 valid_licenses = {'LICENSE-XYZ123', 'LICENSE-ABC456'}
 pending_activation = {}
-username_to_id = {}
+id_to_username = load_json('id_to_username.json', {})  # user_id -> @Username in its original casing, for display
+username_to_id = {name.lower(): user_id for user_id, name in id_to_username.items()}  # Derived, so only id_to_username is persisted
 polls = {}
 
-def is_allowed_group(chat_id: str) -> bool:
-    return str(chat_id) in allowed_groups
-
-# Message deletion function
-async def delete_message_job(context: telegram.ext.CallbackContext):
-    job = context.job
-    chat_id, message_id = job.context
+_save_registry.update({
+    'votes_weekly.pkl': lambda: votes_weekly,
+    'votes_monthly.pkl': lambda: votes_monthly,
+    'votes_alltime.pkl': lambda: votes_alltime,
+    'vote_history.pkl': lambda: vote_history,
+    'user_points.json': lambda: user_points,
+    'alltime_messages.json': lambda: alltime_messages,
+    'chat_streaks.json': lambda: chat_streaks,
+    'last_chat_day.pkl': lambda: last_chat_day,
+    'id_to_username.json': lambda: id_to_username,
+    'featured_media_id.json': lambda: featured_media_id,
+    'featured_media_type.json': lambda: featured_media_type,
+    'barygos_media_id.json': lambda: barygos_media_id,
+    'barygos_media_type.json': lambda: barygos_media_type,
+    PARDAVEJAI_MESSAGE_FILE: lambda: pardavejai_message,
+})
+
+# Rolling 30-day vote window: entries are kept sorted by timestamp so expired ones can be popped from the left
+def prune_monthly(vendor, cutoff):
+    entries = votes_monthly.get(vendor)
+    if not entries:
+        return False
+    pruned = False
+    while entries and entries[0][0] <= cutoff:
+        monthly_totals[vendor] -= entries.popleft()[1]
+        pruned = True
+    return pruned
+
+def record_monthly(vendor, timestamp, delta, now):
+    entries = votes_monthly[vendor]
+    if not entries or timestamp >= entries[-1][0]:
+        entries.append((timestamp, delta))
+    else:
+        bisect.insort(entries, (timestamp, delta))  # Approved downvotes carry the complaint's original timestamp
+    monthly_totals[vendor] += delta
+    prune_monthly(vendor, now - _MONTH)
+
+_startup_cutoff = datetime.now(TIMEZONE) - _MONTH
+for _vendor, _entries in votes_monthly.items():
+    monthly_totals[_vendor] = sum(s for _, s in _entries)
+    prune_monthly(_vendor, _startup_cutoff)
+
+# /balsuoju keyboard is rebuilt only after the seller list changes
+_balsuoju_markup_cache = None
+
+def get_balsuoju_markup():
+    global _balsuoju_markup_cache
+    if _balsuoju_markup_cache is None:
+        _balsuoju_markup_cache = InlineKeyboardMarkup([[InlineKeyboardButton(s, callback_data=f"vote_{s}")] for s in trusted_sellers])
+    return _balsuoju_markup_cache
+
+def rotate_daily_messages(today_date):
+    global today_msgs, yesterday_msgs, current_msg_date
+    if today_date == current_msg_date:
+        return
+    yesterday_msgs = today_msgs if today_date - current_msg_date == timedelta(days=1) else Counter()
+    today_msgs = Counter()
+    current_msg_date = today_date
+
+def is_allowed_group(chat_id: int) -> bool:
+    return chat_id in allowed_groups
+
+# Outbound rate limiting: Telegram allows ~30 messages/s per bot and 20 messages/min per group.
+# Group replies and edits, reply_ephemeral included, go through send() so the per-group window sees every message
+class TgLimiter:
+    def __init__(self, rate=30, chat_limit=20, chat_window=60):
+        self.rate = rate
+        self.chat_limit = chat_limit
+        self.chat_window = chat_window
+        self._tokens = float(rate)
+        self._updated = monotonic()
+        self._lock = asyncio.Lock()
+        self._chat_sends = defaultdict(deque)  # chat_id -> monotonic times of recent sends
+        self._chat_locks = defaultdict(asyncio.Lock)
+
+    # chat_id=None only takes a bot-wide token, for calls like deleteMessage that the per-group limit doesn't count
+    async def acquire(self, chat_id=None):
+        if chat_id is not None and int(chat_id) < 0:  # The per-chat limit only applies to groups
+            chat_id = int(chat_id)
+            async with self._chat_locks[chat_id]:
+                sends = self._chat_sends[chat_id]
+                while True:
+                    now = monotonic()
+                    while sends and now - sends[0] >= self.chat_window:
+                        sends.popleft()
+                    if len(sends) < self.chat_limit:
+                        break
+                    await asyncio.sleep(self.chat_window - (now - sends[0]))
+                sends.append(now)
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens -= 1
+
+limiter = TgLimiter()
+
+async def send(coro_factory, chat_id):
+    await limiter.acquire(chat_id)
     try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except telegram.error.BadRequest as e:
-        if "Message to delete not found" in str(e):
-            pass
-        else:
-            logger.error(f"Failed to delete message: {str(e)}")
+        return await coro_factory()
+    except telegram.error.RetryAfter as e:
+        retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+        logger.warning(f"Flood control hit for chat_id={chat_id}, retrying in {retry_after}s")
+        await asyncio.sleep(retry_after)
+        await limiter.acquire(chat_id)
+        return await coro_factory()
+
+# Message deletion: one heap of (deadline, chat_id, message_id) drained by sweep_deletes, instead of a job per message
+_pending_deletes = []
+_pending_delete_keys = set()  # (chat_id, message_id) already in the heap; the first deadline wins
+
+def schedule_delete(chat_id, message_id, ttl=45):
+    key = (chat_id, message_id)
+    if key in _pending_delete_keys:
+        return
+    _pending_delete_keys.add(key)
+    heapq.heappush(_pending_deletes, (monotonic() + ttl, chat_id, message_id))
+
+async def reply_ephemeral(update, text, ttl=45, **kwargs):
+    msg = await send(lambda: update.message.reply_text(text, **kwargs), update.message.chat_id)
+    schedule_delete(msg.chat_id, msg.message_id, ttl)
+    return msg
+
+_delete_semaphore = asyncio.Semaphore(25)  # Caps in-flight deleteMessage calls; the rate itself comes from limiter
+
+async def delete_message(bot, chat_id, message_id):
+    async with _delete_semaphore:
+        await limiter.acquire()
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except telegram.error.RetryAfter as e:
+            # Its key was already discarded by sweep_deletes, so put it back rather than leave the message up
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            schedule_delete(chat_id, message_id, retry_after)
+        except telegram.error.BadRequest as e:
+            if "Message to delete not found" in str(e):
+                pass
+            else:
+                logger.error(f"Failed to delete message: {str(e)}")
+
+async def sweep_deletes(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    now = monotonic()
+    due = []
+    while _pending_deletes and _pending_deletes[0][0] <= now:
+        _, chat_id, message_id = heapq.heappop(_pending_deletes)
+        _pending_delete_keys.discard((chat_id, message_id))
+        due.append((chat_id, message_id))
+    results = await asyncio.gather(*(delete_message(context.bot, chat_id, message_id) for chat_id, message_id in due), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Failed to delete message: {str(result)}")
+
+def group_only(handler):
+    @functools.wraps(handler)
+    async def wrapper(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+        if not is_allowed_group(update.message.chat_id):
+            await reply_ephemeral(update, "Botas neveikia šioje grupėje!")
+            return
+        return await handler(update, context)
+    return wrapper
 
 # Command handlers
 async def debug(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    if user_id != ADMIN_CHAT_ID:
-        await update.message.reply_text("Tik adminas gali naudoti šią komandą!")
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await send(lambda: update.message.reply_text("Tik adminas gali naudoti šią komandą!"), update.message.chat_id)
         return
     chat_id = update.message.chat_id
     try:
         admins = await context.bot.get_chat_administrators(chat_id)
         admin_list = "\n".join([f"@{m.user.username or m.user.id} (ID: {m.user.id})" for m in admins])
-        msg = await update.message.reply_text(f"Matomi adminai:\n{admin_list}")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, f"Matomi adminai:\n{admin_list}")
     except telegram.error.TelegramError as e:
-        msg = await update.message.reply_text(f"Debug failed: {str(e)}")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, f"Debug failed: {str(e)}")
 
 async def whoami(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
@@ -153,25 +488,22 @@ async def whoami(update: telegram.Update, context: telegram.ext.ContextTypes.DEF
     try:
         member = await context.bot.get_chat_member(chat_id, user_id)
         username = f"@{member.user.username}" if member.user.username else "No username"
-        msg = await update.message.reply_text(f"Jūs esate: {username} (ID: {user_id})")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, f"Jūs esate: {username} (ID: {user_id})")
     except telegram.error.TelegramError as e:
-        msg = await update.message.reply_text(f"Error: {str(e)}")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, f"Error: {str(e)}")
 
 async def startas(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
     if chat_id != user_id:
         if is_allowed_group(chat_id):
-            msg = await update.message.reply_text(
+            await reply_ephemeral(
+                update,
                 "Sveiki! Use /balsuoju to vote for sellers with buttons. /nepatiko for downvotes (5 pts). "
                 "Chat daily for 1-3 pts + streaks. Check /barygos, /chatking, /coinflip, or /apklausa!"
             )
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
         else:
-            msg = await update.message.reply_text("Šis botas skirtas tik mano grupėms! Siųsk /startas Password privačiai!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, "Šis botas skirtas tik mano grupėms! Siųsk /startas Password privačiai!")
     else:
         try:
             password = context.args[0]
@@ -185,45 +517,43 @@ async def startas(update: telegram.Update, context: telegram.ext.ContextTypes.DE
 
 async def activate_group(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    if str(user_id) != ADMIN_CHAT_ID:
-        await update.message.reply_text("Tik adminas gali aktyvuoti grupes!")
+    if user_id != ADMIN_ID:
+        await send(lambda: update.message.reply_text("Tik adminas gali aktyvuoti grupes!"), update.message.chat_id)
         return
     if user_id not in pending_activation:
-        await update.message.reply_text("Pirma įvesk slaptažodį privačiai!")
+        await send(lambda: update.message.reply_text("Pirma įvesk slaptažodį privačiai!"), update.message.chat_id)
         return
     try:
-        group_id = context.args[0]
+        group_id = int(context.args[0])
         if group_id in allowed_groups:
-            await update.message.reply_text("Grupė jau aktyvuota!")
+            await send(lambda: update.message.reply_text("Grupė jau aktyvuota!"), update.message.chat_id)
         else:
+            allowed_chats_filter.add_chat_ids(group_id)
             allowed_groups.add(group_id)
             if pending_activation[user_id] != "password":
                 valid_licenses.remove(pending_activation[user_id])
             del pending_activation[user_id]
-            await update.message.reply_text(f"Grupė {group_id} aktyvuota! Use /startas in the group.")
-    except IndexError:
-        await update.message.reply_text("Naudok: /activate_group GroupChatID")
+            await send(lambda: update.message.reply_text(f"Grupė {group_id} aktyvuota! Use /startas in the group."), update.message.chat_id)
+    except (IndexError, ValueError):
+        await send(lambda: update.message.reply_text("Naudok: /activate_group GroupChatID"), update.message.chat_id)
 
 async def privatus(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali naudoti šią komandą!")
-        context.job_queue.run_once(delete_message_job, 45, context=(update.message.chat_id, msg.message_id))
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali naudoti šią komandą!")
         return
     chat_id = update.message.chat_id
     if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Botas neveikia šioje grupėje!")
         return
     keyboard = [[InlineKeyboardButton("Valdyti privačiai", url=f"https://t.me/{context.bot.username}")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    msg = await update.message.reply_text("Spausk mygtuką, kad valdytum botą privačiai:", reply_markup=reply_markup)
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    await reply_ephemeral(update, "Spausk mygtuką, kad valdytum botą privačiai:", reply_markup=reply_markup)
 
 async def start_private(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
+    user_id = update.message.from_user.id
     chat_id = update.message.chat_id
-    if chat_id == int(user_id) and user_id == ADMIN_CHAT_ID:
+    if chat_id == user_id and user_id == ADMIN_ID:
         keyboard = [
             [InlineKeyboardButton("Pridėti pardavėją", callback_data="admin_addseller")],
             [InlineKeyboardButton("Pašalinti pardavėją", callback_data="admin_removeseller")],
@@ -234,12 +564,12 @@ async def start_private(update: telegram.Update, context: telegram.ext.ContextTy
 
 async def handle_admin_button(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = str(query.from_user.id)
-    if user_id != ADMIN_CHAT_ID:
+    user_id = query.from_user.id
+    if user_id != ADMIN_ID:
         await query.answer("Tik adminas gali tai daryti!")
         return
     chat_id = query.message.chat_id
-    if chat_id != int(user_id):
+    if chat_id != user_id:
         await query.answer("Šią komandą naudok privačiai!")
         return
 
@@ -252,41 +582,32 @@ async def handle_admin_button(update: telegram.Update, context: telegram.ext.Con
         await query.edit_message_text("Įvesk: /editpardavejai 'Naujas tekstas'")
     await query.answer()
 
+# Media type (as stored by /addftbaryga and /addftbaryga2) -> Bot method; each method takes the file id under a kwarg named after the type
+_MEDIA_SENDERS = {'photo': 'send_photo', 'animation': 'send_animation', 'video': 'send_video'}
+
+@group_only
 async def balsuoju(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
 
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
-
-    keyboard = [[InlineKeyboardButton(seller, callback_data=f"vote_{seller}")] for seller in trusted_sellers]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    if 'featured_media_id' in globals() and featured_media_id and featured_media_type:
-        if featured_media_type == 'photo':
-            msg = await context.bot.send_photo(chat_id=chat_id, photo=featured_media_id, caption=pardavejai_message, reply_markup=reply_markup)
-        elif featured_media_type == 'animation':
-            msg = await context.bot.send_animation(chat_id=chat_id, animation=featured_media_id, caption=pardavejai_message, reply_markup=reply_markup)
-        elif featured_media_type == 'video':
-            msg = await context.bot.send_video(chat_id=chat_id, video=featured_media_id, caption=pardavejai_message, reply_markup=reply_markup)
+    reply_markup = get_balsuoju_markup()
+    if featured_media_id and featured_media_type:
+        send_media = getattr(context.bot, _MEDIA_SENDERS[featured_media_type])
+        msg = await send(lambda: send_media(chat_id=chat_id, **{featured_media_type: featured_media_id}, caption=pardavejai_message, reply_markup=reply_markup), chat_id)
     else:
-        msg = await context.bot.send_message(chat_id=chat_id, text=pardavejai_message, reply_markup=reply_markup)
+        msg = await send(lambda: context.bot.send_message(chat_id=chat_id, text=pardavejai_message, reply_markup=reply_markup), chat_id)
     
     # Store the message ID in context.user_data for later deletion
     context.user_data[f'balsuoju_message_{user_id}'] = (chat_id, msg.message_id)
     logger.info(f"/balsuoju called by user_id={user_id} in chat_id={chat_id}, buttons sent to group, message_id={msg.message_id}")
 
 async def addftbaryga(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali pridėti media!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali pridėti media!")
         return
     if not update.message.reply_to_message:
-        msg = await update.message.reply_text("Atsakyk į žinutę su paveikslėliu, GIF ar video!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Atsakyk į žinutę su paveikslėliu, GIF ar video!")
         return
     
     global featured_media_id, featured_media_type, last_addftbaryga_message
@@ -307,25 +628,19 @@ async def addftbaryga(update: telegram.Update, context: telegram.ext.ContextType
         featured_media_type = 'video'
         last_addftbaryga_message = "Video pridėtas prie /balsuoju!"
     else:
-        msg = await update.message.reply_text("Atsakyk į žinutę su paveikslėliu, GIF ar video!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Atsakyk į žinutę su paveikslėliu, GIF ar video!")
         return
     
-    save_data(featured_media_id, 'featured_media_id.pkl')
-    save_data(featured_media_type, 'featured_media_type.pkl')
-    msg = await update.message.reply_text(last_addftbaryga_message)
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    mark_dirty('featured_media_id.json', 'featured_media_type.json')
+    await reply_ephemeral(update, last_addftbaryga_message)
 
 async def addftbaryga2(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali pridėti media!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali pridėti media!")
         return
     if not update.message.reply_to_message:
-        msg = await update.message.reply_text("Atsakyk į žinutę su paveikslėliu, GIF ar video!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Atsakyk į žinutę su paveikslėliu, GIF ar video!")
         return
     
     global barygos_media_id, barygos_media_type, last_addftbaryga2_message
@@ -346,37 +661,30 @@ async def addftbaryga2(update: telegram.Update, context: telegram.ext.ContextTyp
         barygos_media_type = 'video'
         last_addftbaryga2_message = "Video pridėtas prie /barygos!"
     else:
-        msg = await update.message.reply_text("Atsakyk į žinutę su paveikslėliu, GIF ar video!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Atsakyk į žinutę su paveikslėliu, GIF ar video!")
         return
     
-    save_data(barygos_media_id, 'barygos_media_id.pkl')
-    save_data(barygos_media_type, 'barygos_media_type.pkl')
-    msg = await update.message.reply_text(last_addftbaryga2_message)
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    invalidate_barygos()
+    mark_dirty('barygos_media_id.json', 'barygos_media_type.json')
+    await reply_ephemeral(update, last_addftbaryga2_message)
 
 async def editpardavejai(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali redaguoti šį tekstą!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali redaguoti šį tekstą!")
         return
 
     try:
         new_message = " ".join(context.args)
         if not new_message:
-            msg = await update.message.reply_text("Naudok: /editpardavejai 'Naujas tekstas'")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, "Naudok: /editpardavejai 'Naujas tekstas'")
             return
         global pardavejai_message
         pardavejai_message = new_message
-        save_pardavejai_message()
-        msg = await update.message.reply_text(f"Pardavėjų žinutė atnaujinta: '{pardavejai_message}'")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        mark_dirty(PARDAVEJAI_MESSAGE_FILE)
+        await reply_ephemeral(update, f"Pardavėjų žinutė atnaujinta: '{pardavejai_message}'")
     except IndexError:
-        msg = await update.message.reply_text("Naudok: /editpardavejai 'Naujas tekstas'")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /editpardavejai 'Naujas tekstas'")
 
 async def handle_vote_button(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
@@ -387,90 +695,78 @@ async def handle_vote_button(update: telegram.Update, context: telegram.ext.Cont
     user_id = query.from_user.id
     if query.message is None:
         await query.answer("Klaida: Balsavimo žinutė nerasta. Prašau bandyti dar kartą.")
-        logger.error(f"Message is None for user_id={user_id}, callback_data={query.data}")
+        logger.error("Message is None for user_id=%s, callback_data=%s", user_id, query.data)
         return
     
     chat_id = query.message.chat_id  # This is the group chat_id
     data = query.data
 
-    logger.info(f"Vote attempt by user_id={user_id} in chat_id={chat_id}, callback_data={data}")
+    logger.info("Vote attempt by user_id=%s in chat_id=%s, callback_data=%s", user_id, chat_id, data)
 
     if not data.startswith("vote_"):
-        logger.warning(f"Invalid callback data: {data} from user_id={user_id}")
+        logger.warning("Invalid callback data: %s from user_id=%s", data, user_id)
         return
 
     seller = data.replace("vote_", "")
     if seller not in trusted_sellers:
         await query.answer("Šis pardavėjas nebegalioja!")
-        logger.warning(f"Attempt to vote for invalid seller '{seller}' by user_id={user_id}. Trusted sellers: {trusted_sellers}")
+        logger.warning("Attempt to vote for invalid seller '%s' by user_id=%s. Trusted sellers: %s", seller, user_id, list(trusted_sellers))
         # Delete the message even if the seller is invalid
         if f'balsuoju_message_{user_id}' in context.user_data:
             chat_id, message_id = context.user_data[f'balsuoju_message_{user_id}']
-            context.job_queue.run_once(delete_message_job, 5, context=(chat_id, message_id))
+            schedule_delete(chat_id, message_id, 5)
             del context.user_data[f'balsuoju_message_{user_id}']
         return
 
     now = datetime.now(TIMEZONE)
-    last_vote = last_vote_attempt.get(user_id, datetime.min.replace(tzinfo=TIMEZONE))
-    cooldown_remaining = timedelta(days=7) - (now - last_vote)
-    if cooldown_remaining > timedelta(0):
+    last_vote = last_vote_attempt.get(user_id, _MIN_DT)
+    cooldown_remaining = _VOTE_COOLDOWN - (now - last_vote)
+    if cooldown_remaining > _ZERO:
         days_left = max(1, int(cooldown_remaining.total_seconds() // 86400))
         await query.answer(f"Tu jau balsavai! Liko {days_left} dienų iki kito balsavimo.")
-        await context.bot.send_message(chat_id=chat_id, text=f"@{query.from_user.username or 'User' + str(user_id)}, tu jau balsavai! Liko {days_left} dienų iki kito balsavimo.")
+        await send(lambda: context.bot.send_message(chat_id=chat_id, text=f"@{query.from_user.username or 'User' + str(user_id)}, tu jau balsavai! Liko {days_left} dienų iki kito balsavimo."), chat_id)
         # Delete the balsuoju message after showing cooldown
         if f'balsuoju_message_{user_id}' in context.user_data:
             chat_id, message_id = context.user_data[f'balsuoju_message_{user_id}']
-            context.job_queue.run_once(delete_message_job, 5, context=(chat_id, message_id))
+            schedule_delete(chat_id, message_id, 5)
             del context.user_data[f'balsuoju_message_{user_id}']
-        logger.info(f"User_id={user_id} blocked by cooldown, {days_left} days left.")
+        logger.info("User_id=%s blocked by cooldown, %s days left.", user_id, days_left)
         return
 
-    user_points.setdefault(user_id, 0)
-    votes_weekly.setdefault(seller, 0)
-    votes_alltime.setdefault(seller, 0)
-    votes_monthly.setdefault(seller, [])
-
-    logger.info(f"Before vote: user_id={user_id}, points={user_points[user_id]}, votes_weekly[{seller}]={votes_weekly[seller]}, votes_alltime[{seller}]={votes_alltime[seller]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Before vote: user_id=%s, points=%s, votes_weekly[%s]=%s, votes_alltime[%s]=%s", user_id, user_points[user_id], seller, votes_weekly[seller], seller, votes_alltime[seller])
 
     votes_weekly[seller] += 1
-    votes_monthly[seller].append((now, 1))
+    record_monthly(seller, now, 1, now)
     votes_alltime[seller] += 1
-    voters.add(user_id)
-    vote_history[seller].append((user_id, "up", "Button vote", now))
+    vote_history[seller].add(user_id, "up", "Button vote", now)
     user_points[user_id] += 5
     last_vote_attempt[user_id] = now
 
-    logger.info(f"After vote: user_id={user_id}, points={user_points[user_id]}, votes_weekly[{seller}]={votes_weekly[seller]}, votes_alltime[{seller}]={votes_alltime[seller]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("After vote: user_id=%s, points=%s, votes_weekly[%s]=%s, votes_alltime[%s]=%s", user_id, user_points[user_id], seller, votes_weekly[seller], seller, votes_alltime[seller])
 
     await query.answer("Ačiū už jūsų balsą, 5 taškai buvo pridėti prie jūsų sąskaitos.")
-    await query.edit_message_text(f"Ačiū už jūsų balsą už {seller}, 5 taškai pridėti!")
+    await send(lambda: query.edit_message_text(f"Ačiū už jūsų balsą už {seller}, 5 taškai pridėti!"), query.message.chat_id)
     
     # Delete the balsuoju message after successful vote
     if f'balsuoju_message_{user_id}' in context.user_data:
         chat_id, message_id = context.user_data[f'balsuoju_message_{user_id}']
-        context.job_queue.run_once(delete_message_job, 5, context=(chat_id, message_id))
+        schedule_delete(chat_id, message_id, 5)
         del context.user_data[f'balsuoju_message_{user_id}']
     
-    save_data(votes_weekly, 'votes_weekly.pkl')
-    save_data(votes_monthly, 'votes_monthly.pkl')
-    save_data(votes_alltime, 'votes_alltime.pkl')
-    save_data(vote_history, 'vote_history.pkl')
-    save_data(user_points, 'user_points.pkl')
+    invalidate_barygos()
+    mark_dirty('votes_weekly.pkl', 'votes_monthly.pkl', 'votes_alltime.pkl', 'vote_history.pkl', 'user_points.json')
 
+@group_only
 async def apklausa(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
 
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
-
     try:
         question = " ".join(context.args)
         if not question:
-            msg = await update.message.reply_text("Naudok: /apklausa 'Klausimas'")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, "Naudok: /apklausa 'Klausimas'")
             return
 
         poll_id = f"{chat_id}_{user_id}_{int(datetime.now(TIMEZONE).timestamp())}"
@@ -482,11 +778,10 @@ async def apklausa(update: telegram.Update, context: telegram.ext.ContextTypes.D
              InlineKeyboardButton("Ne (0)", callback_data=f"poll_{poll_id}_no")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(f"📊 Apklausa: {question}", reply_markup=reply_markup)
+        await send(lambda: update.message.reply_text(f"📊 Apklausa: {question}", reply_markup=reply_markup), update.message.chat_id)
         # No deletion scheduled for /apklausa
     except IndexError:
-        msg = await update.message.reply_text("Naudok: /apklausa 'Klausimas'")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /apklausa 'Klausimas'")
 
 async def handle_poll_button(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
@@ -498,15 +793,16 @@ async def handle_poll_button(update: telegram.Update, context: telegram.ext.Cont
 
     parts = data.rsplit("_", 1)
     if len(parts) != 2:
-        logger.error(f"Invalid callback data format: {data}")
+        logger.error("Invalid callback data format: %s", data)
         await query.answer("Klaida balsuojant!")
         return
 
     poll_id, vote = parts[0][5:], parts[1]
-    logger.info(f"Poll button pressed: data={data}, poll_id={poll_id}, vote={vote}, polls.keys={list(polls.keys())}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Poll button pressed: data=%s, poll_id=%s, vote=%s, polls.keys=%s", data, poll_id, vote, list(polls))
 
     if poll_id not in polls:
-        logger.error(f"Poll ID {poll_id} not found in polls: {polls}")
+        logger.error("Poll ID %s not found in polls: %s", poll_id, polls)
         await query.answer("Ši apklausa nebegalioja!")
         return
 
@@ -521,31 +817,41 @@ async def handle_poll_button(update: telegram.Update, context: telegram.ext.Cont
     elif vote == "no":
         poll["no"] += 1
     else:
-        logger.error(f"Invalid vote type: {vote}")
+        logger.error("Invalid vote type: %s", vote)
         await query.answer("Klaida balsuojant!")
         return
 
+    await query.answer("Tavo balsas užskaitytas!")
+    # Coalesce bursts of votes into one message edit carrying the latest tally
+    if poll.get("pending_edit_task") is None:
+        poll["pending_edit_task"] = asyncio.create_task(_debounced_poll_edit(poll_id, query, 0.5))
+
+async def _debounced_poll_edit(poll_id, query, delay):
+    await asyncio.sleep(delay)
+    poll = polls.get(poll_id)
+    if poll is None:
+        return
+    poll["pending_edit_task"] = None  # Votes arriving during the edit schedule a fresh one
     keyboard = [
         [InlineKeyboardButton(f"Taip ({poll['yes']})", callback_data=f"poll_{poll_id}_yes"),
          InlineKeyboardButton(f"Ne ({poll['no']})", callback_data=f"poll_{poll_id}_no")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(f"📊 Apklausa: {poll['question']}\nBalsai: Taip - {poll['yes']}, Ne - {poll['no']}", reply_markup=reply_markup)
-    await query.answer("Tavo balsas užskaitytas!")
+    try:
+        await send(
+            lambda: query.edit_message_text(f"📊 Apklausa: {poll['question']}\nBalsai: Taip - {poll['yes']}, Ne - {poll['no']}", reply_markup=reply_markup),
+            query.message.chat_id,
+        )
+    except telegram.error.TelegramError as e:
+        logger.error(f"Failed to update poll {poll_id}: {str(e)}")
 
+@group_only
 async def nepatiko(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.message.chat_id
     user_id = update.message.from_user.id
     
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
-    
     now = datetime.now(TIMEZONE)
-    if now - last_downvote_attempt[user_id] < timedelta(days=7):
-        msg = await update.message.reply_text("Palauk 7 dienas po paskutinio nepritarimo!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    if now - last_downvote_attempt.get(user_id, _MIN_DT) < _DOWNVOTE_COOLDOWN:
+        await reply_ephemeral(update, "Palauk 7 dienas po paskutinio nepritarimo!")
         return
     
     try:
@@ -554,149 +860,135 @@ async def nepatiko(update: telegram.Update, context: telegram.ext.ContextTypes.D
             vendor = '@' + vendor  # Normalize by adding '@'
         reason = " ".join(context.args[1:])
         if not reason:
-            msg = await update.message.reply_text("Prašau nurodyti priežastį!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, "Prašau nurodyti priežastį!")
             return
         
         global complaint_id
         complaint_id += 1
-        pending_downvotes[complaint_id] = (vendor, user_id, reason, now)
-        downvoters.add(user_id)
-        vote_history.setdefault(vendor, []).append((user_id, "down", reason, now))
+        pending_downvotes[complaint_id] = Complaint(vendor, user_id, reason, now)
+        vote_history[vendor].add(user_id, "down", reason, now)
         user_points[user_id] += 5
         last_downvote_attempt[user_id] = now
-        await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
+        await send(lambda: context.bot.send_message(
+            chat_id=ADMIN_ID,
             text=f"Skundas #{complaint_id}: {vendor} - '{reason}' by User {user_id}. Patvirtinti su /approve {complaint_id}"
-        )
-        msg = await update.message.reply_text(f"Skundas pateiktas! Atsiųsk įrodymus @kunigasnew dėl Skundo #{complaint_id}. +5 taškų!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        save_data(vote_history, 'vote_history.pkl')
-        save_data(user_points, 'user_points.pkl')
+        ), ADMIN_ID)
+        await reply_ephemeral(update, f"Skundas pateiktas! Atsiųsk įrodymus @kunigasnew dėl Skundo #{complaint_id}. +5 taškų!")
+        mark_dirty('vote_history.pkl', 'user_points.json')
     except IndexError:
-        msg = await update.message.reply_text("Naudok: /nepatiko @VendorTag 'Reason'")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /nepatiko @VendorTag 'Reason'")
 
 async def approve(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
+    user_id = update.message.from_user.id
     chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
+    if user_id != ADMIN_ID:
         return
-    if not (is_allowed_group(chat_id) or chat_id == int(user_id)):
-        msg = await update.message.reply_text("Ši komanda veikia tik grupėje arba privačiai!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    if not (is_allowed_group(chat_id) or chat_id == user_id):
+        await reply_ephemeral(update, "Ši komanda veikia tik grupėje arba privačiai!")
         return
     try:
         cid = int(context.args[0])
         if cid not in pending_downvotes:
-            msg = await update.message.reply_text("Neteisingas skundo ID!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, "Neteisingas skundo ID!")
             return
-        vendor, user_id, reason, timestamp = pending_downvotes[cid]
+        complaint = approved_downvotes[cid] = pending_downvotes.pop(cid)
+        vendor = complaint.vendor
         votes_weekly[vendor] -= 1
-        votes_monthly[vendor].append((timestamp, -1))
+        record_monthly(vendor, complaint.ts, -1, datetime.now(TIMEZONE))
         votes_alltime[vendor] -= 1
-        approved_downvotes[cid] = pending_downvotes[cid]
-        del pending_downvotes[cid]
-        msg = await update.message.reply_text(f"Skundas patvirtintas dėl {vendor}!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        save_data(votes_weekly, 'votes_weekly.pkl')
-        save_data(votes_monthly, 'votes_monthly.pkl')
-        save_data(votes_alltime, 'votes_alltime.pkl')
+        await reply_ephemeral(update, f"Skundas patvirtintas dėl {vendor}!")
+        invalidate_barygos()
+        mark_dirty('votes_weekly.pkl', 'votes_monthly.pkl', 'votes_alltime.pkl')
     except (IndexError, ValueError):
-        msg = await update.message.reply_text("Naudok: /approve ComplaintID")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /approve ComplaintID")
 
 async def addseller(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
+    user_id = update.message.from_user.id
     chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali pridėti pardavėją!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali pridėti pardavėją!")
         return
-    if not is_allowed_group(chat_id) and chat_id != int(user_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje arba naudok privačiai!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    if not is_allowed_group(chat_id) and chat_id != user_id:
+        await reply_ephemeral(update, "Botas neveikia šioje grupėje arba naudok privačiai!")
         return
     try:
         vendor = context.args[0]
         if not vendor.startswith('@'):
             vendor = '@' + vendor  # Normalize by adding '@'
-        if vendor in trusted_sellers:
-            msg = await update.message.reply_text(f"{vendor} jau yra patikimų pardavėjų sąraše!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        if vendor.lower() in _lower_to_seller:
+            await reply_ephemeral(update, f"{_lower_to_seller[vendor.lower()]} jau yra patikimų pardavėjų sąraše!")
             return
-        trusted_sellers.append(vendor)
-        msg = await update.message.reply_text(f"Pardavėjas {vendor} pridėtas! Jis dabar matomas /balsuoju sąraše.")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        trusted_sellers[vendor] = None
+        _lower_to_seller[vendor.lower()] = vendor
+        votes_weekly.setdefault(vendor, 0)
+        votes_monthly.setdefault(vendor, deque())
+        votes_alltime.setdefault(vendor, 0)
+        vote_history.setdefault(vendor, VoteHistory())
+        global _balsuoju_markup_cache
+        _balsuoju_markup_cache = None
+        await reply_ephemeral(update, f"Pardavėjas {vendor} pridėtas! Jis dabar matomas /balsuoju sąraše.")
+        invalidate_barygos()
     except IndexError:
-        msg = await update.message.reply_text("Naudok: /addseller @VendorTag")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /addseller @VendorTag")
 
 async def removeseller(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
+    user_id = update.message.from_user.id
     chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali pašalinti pardavėją!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali pašalinti pardavėją!")
         return
-    if not is_allowed_group(chat_id) and chat_id != int(user_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje arba naudok privačiai!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    if not is_allowed_group(chat_id) and chat_id != user_id:
+        await reply_ephemeral(update, "Botas neveikia šioje grupėje arba naudok privačiai!")
         return
     try:
         vendor = context.args[0]
         if not vendor.startswith('@'):
             vendor = '@' + vendor  # Normalize by adding '@'
-        if vendor not in trusted_sellers:
-            msg = await update.message.reply_text(f"'{vendor}' nėra patikimų pardavėjų sąraše! Sąrašas: {trusted_sellers}")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        matching = _lower_to_seller.pop(vendor.lower(), None)
+        if matching is None:
+            await reply_ephemeral(update, f"'{vendor}' nėra patikimų pardavėjų sąraše! Sąrašas: {', '.join(trusted_sellers)}")
             return
-        trusted_sellers.remove(vendor)
+        vendor = matching
+        del trusted_sellers[vendor]
+        global _balsuoju_markup_cache
+        _balsuoju_markup_cache = None
         votes_weekly.pop(vendor, None)
         votes_monthly.pop(vendor, None)
+        monthly_totals.pop(vendor, None)
         votes_alltime.pop(vendor, None)
-        msg = await update.message.reply_text(f"Pardavėjas {vendor} pašalintas iš sąrašo ir balsų!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        save_data(votes_weekly, 'votes_weekly.pkl')
-        save_data(votes_monthly, 'votes_monthly.pkl')
-        save_data(votes_alltime, 'votes_alltime.pkl')
+        await reply_ephemeral(update, f"Pardavėjas {vendor} pašalintas iš sąrašo ir balsų!")
+        invalidate_barygos()
+        mark_dirty('votes_weekly.pkl', 'votes_monthly.pkl', 'votes_alltime.pkl')
     except IndexError:
-        msg = await update.message.reply_text("Naudok: /removeseller @VendorTag")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /removeseller @VendorTag")
 
+@group_only
 async def sellerinfo(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.message.chat_id
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
     try:
         vendor = context.args[0]
         if not vendor.startswith('@'):
             vendor = '@' + vendor  # Normalize by adding '@'
         if vendor not in trusted_sellers:
-            msg = await update.message.reply_text(f"{vendor} nėra patikimas pardavėjas!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, f"{vendor} nėra patikimas pardavėjas!")
             return
-        now = datetime.now(TIMEZONE)
-        monthly_score = sum(s for ts, s in votes_monthly[vendor] if now - ts < timedelta(days=30))
-        downvotes_30d = sum(1 for cid, (v, _, _, ts) in approved_downvotes.items() if v == vendor and now - ts < timedelta(days=30))
+        cutoff = datetime.now(TIMEZONE) - _MONTH
+        if prune_monthly(vendor, cutoff):
+            mark_dirty('votes_monthly.pkl')
+        monthly_score = monthly_totals.get(vendor, 0)
+        downvotes_30d = sum(1 for complaint in approved_downvotes.values() if complaint.vendor == vendor and complaint.ts > cutoff)
         info = f"{vendor} Info:\nSavaitė: {votes_weekly[vendor]}\nMėnuo: {monthly_score}\nViso: {votes_alltime[vendor]}\nNeigiami (30d): {downvotes_30d}"
-        msg = await update.message.reply_text(info)
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, info)
     except IndexError:
-        msg = await update.message.reply_text("Naudok: /pardavejoinfo @VendorTag")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /pardavejoinfo @VendorTag")
 
-async def barygos(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.message.chat_id
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
+# Rendered /barygos text, reused for 30s; anything that changes votes, sellers or the header resets it
+_barygos_cache = {'text': None, 'expires': 0.0}
+
+def invalidate_barygos():
+    _barygos_cache['expires'] = 0.0
+
+def render_barygos():
     now = datetime.now(TIMEZONE)
-    
     message = ""
     if last_addftbaryga2_message:
         message += f"{last_addftbaryga2_message}\n\n"
@@ -705,98 +997,106 @@ async def barygos(update: telegram.Update, context: telegram.ext.ContextTypes.DE
     if not votes_weekly:
         weekly_board += "Dar nėra balsų šią savaitę!\n"
     else:
-        sorted_weekly = sorted(votes_weekly.items(), key=lambda x: x[1], reverse=True)
-        for vendor, score in sorted_weekly[:3]:
+        for vendor, score in heapq.nlargest(3, votes_weekly.items(), key=lambda x: x[1]):
             weekly_board += f"{vendor[1:]}: {score}\n"  # Remove @ from vendor name
     
     monthly_board = "📅 Mėnesio Top Pardavėjai 📅\n"
-    monthly_totals = defaultdict(int)
-    for vendor, votes_list in votes_monthly.items():
-        recent_votes = [(ts, s) for ts, s in votes_list if now - ts < timedelta(days=30)]
-        monthly_totals[vendor] = sum(s for _, s in recent_votes)
+    cutoff = now - _MONTH
+    pruned = False
+    for vendor in votes_monthly:
+        pruned |= prune_monthly(vendor, cutoff)
+    if pruned:
+        mark_dirty('votes_monthly.pkl')
     if not monthly_totals:
         monthly_board += "Nėra balsų per 30 dienų!\n"
     else:
-        sorted_monthly = sorted(monthly_totals.items(), key=lambda x: x[1], reverse=True)
-        for vendor, score in sorted_monthly[:3]:
+        for vendor, score in heapq.nlargest(3, monthly_totals.items(), key=lambda x: x[1]):
             monthly_board += f"{vendor[1:]}: {score}\n"  # Remove @ from vendor name
     
     alltime_board = "🌟 Visų Laikų Top 5 Pardavėjai 🌟\n"
     if not votes_alltime:
         alltime_board += "Dar nėra balsų!\n"
     else:
-        sorted_alltime = sorted(votes_alltime.items(), key=lambda x: x[1], reverse=True)
-        for i, (vendor, score) in enumerate(sorted_alltime[:5], 1):
+        for i, (vendor, score) in enumerate(heapq.nlargest(5, votes_alltime.items(), key=lambda x: x[1]), 1):
             alltime_board += f"{i}. {vendor[1:]}: {score}\n"  # Remove @ from vendor name
     
-    full_message = f"{message}{weekly_board}\n{monthly_board}\n{alltime_board}"
-    if 'barygos_media_id' in globals() and barygos_media_id and barygos_media_type:
-        if barygos_media_type == 'photo':
-            msg = await context.bot.send_photo(chat_id=chat_id, photo=barygos_media_id, caption=full_message)
-        elif barygos_media_type == 'animation':
-            msg = await context.bot.send_animation(chat_id=chat_id, animation=barygos_media_id, caption=full_message)
-        elif barygos_media_type == 'video':
-            msg = await context.bot.send_video(chat_id=chat_id, video=barygos_media_id, caption=full_message)
+    return f"{message}{weekly_board}\n{monthly_board}\n{alltime_board}"
+
+@group_only
+async def barygos(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.message.chat_id
+    if monotonic() < _barygos_cache['expires']:
+        full_message = _barygos_cache['text']
+    else:
+        full_message = render_barygos()
+        _barygos_cache.update(text=full_message, expires=monotonic() + 30)
+    if barygos_media_id and barygos_media_type:
+        send_media = getattr(context.bot, _MEDIA_SENDERS[barygos_media_type])
+        msg = await send(lambda: send_media(chat_id=chat_id, **{barygos_media_type: barygos_media_id}, caption=full_message), chat_id)
     else:
-        msg = await context.bot.send_message(chat_id=chat_id, text=full_message)
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        msg = await send(lambda: context.bot.send_message(chat_id=chat_id, text=full_message), chat_id)
+    schedule_delete(chat_id, msg.message_id)
 
+@group_only
 async def chatking(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
     
     if not alltime_messages:
-        msg = await update.message.reply_text("Dar nėra žinučių!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Dar nėra žinučių!")
         return
     
-    sorted_chatters = sorted(alltime_messages.items(), key=lambda x: x[1], reverse=True)[:10]
-    leaderboard = "👑 Visų Laikų Pokalbių Karaliai 👑\n"
+    sorted_chatters = heapq.nlargest(10, alltime_messages.items(), key=lambda x: x[1])
+    # Resolve names from the local cache and fetch only the misses from Telegram, concurrently
+    misses = [user_id for user_id, _ in sorted_chatters if user_id not in id_to_username]
+    members = await asyncio.gather(*(context.bot.get_chat_member(chat_id, user_id) for user_id in misses), return_exceptions=True)
+    fetched = {}
+    for user_id, member in zip(misses, members):
+        if not isinstance(member, Exception) and member.user.username:
+            fetched[user_id] = f"@{member.user.username}"
+    lines = ["👑 Visų Laikų Pokalbių Karaliai 👑\n"]
     for user_id, msg_count in sorted_chatters:
-        try:
-            member = await context.bot.get_chat_member(chat_id, user_id)
-            username = f"@{member.user.username}" if member.user.username else f"User {user_id}"
-            leaderboard += f"{username}: {msg_count} žinučių\n"
-        except telegram.error.TelegramError:
-            leaderboard += f"User {user_id}: {msg_count} žinučių\n"
+        username = id_to_username.get(user_id) or fetched.get(user_id, f"User {user_id}")
+        lines.append(f"{username}: {msg_count} žinučių\n")
     
-    msg = await update.message.reply_text(leaderboard)
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    await reply_ephemeral(update, ''.join(lines))
 
 async def handle_message(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.message.chat_id
-    if not is_allowed_group(chat_id) or update.message.text.startswith('/'):
+    global _msgs_since_save
+    if update.message is None or update.message.text.startswith('/'):
         return
     user_id = update.message.from_user.id
     username = update.message.from_user.username
     if username:
-        username_to_id[f"@{username.lower()}"] = user_id
+        display_name = f"@{username}"
+        old_username = id_to_username.get(user_id)
+        if old_username != display_name:
+            if old_username:
+                username_to_id.pop(old_username.lower(), None)
+            username_to_id[display_name.lower()] = user_id
+            id_to_username[user_id] = display_name
+            mark_dirty('id_to_username.json')
     
-    today = datetime.now(TIMEZONE)
-    daily_messages[user_id][today.date()] += 1
+    now = datetime.now(TIMEZONE)
+    today_date = now.date()
+    rotate_daily_messages(today_date)
+    today_msgs[user_id] += 1
     weekly_messages[user_id] += 1
-    alltime_messages.setdefault(user_id, 0)
     alltime_messages[user_id] += 1
     
-    yesterday = today - timedelta(days=1)
-    last_day = last_chat_day[user_id].date()
-    if last_day == yesterday.date():
+    last_day = last_chat_day.get(user_id, _MIN_DT).date()
+    if last_day == today_date - timedelta(days=1):
         chat_streaks[user_id] += 1
-    elif last_day != today.date():
+    elif last_day != today_date:
         chat_streaks[user_id] = 1
-    last_chat_day[user_id] = today
-    save_data(alltime_messages, 'alltime_messages.pkl')
-    save_data(chat_streaks, 'chat_streaks.pkl')
-    save_data(last_chat_day, 'last_chat_day.pkl')
+    last_chat_day[user_id] = now
+    _msgs_since_save += 1
+    if _msgs_since_save >= 50:
+        mark_messages_dirty()
 
 async def award_daily_points(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    today = datetime.now(TIMEZONE).date()
-    yesterday = today - timedelta(days=1)
-    for user_id in daily_messages:
-        msg_count = daily_messages[user_id].get(yesterday, 0)
+    rotate_daily_messages(datetime.now(TIMEZONE).date())
+    counts = yesterday_msgs
+    for user_id, msg_count in counts.items():
         if msg_count < 50:
             continue
         
@@ -809,134 +1109,124 @@ async def award_daily_points(context: telegram.ext.ContextTypes.DEFAULT_TYPE) ->
         if streak_bonus > 0:
             msg += f" +{streak_bonus} už {chat_streaks[user_id]}-dienų seriją!"
         
-        try:
-            username = next(k for k, v in username_to_id.items() if v == user_id)
-            await context.bot.send_message(
-                chat_id=GROUP_CHAT_ID,
-                text=f"{username}, {msg} Dabar turi {user_points[user_id]} taškų!"
-            )
-        except StopIteration:
-            pass
+        username = id_to_username.get(user_id)
+        if username is None:
+            continue
+        text = f"{username}, {msg} Dabar turi {user_points[user_id]} taškų!"
+        await send(lambda: context.bot.send_message(chat_id=GROUP_ID, text=text), GROUP_ID)
     
-    daily_messages.clear()
-    save_data(user_points, 'user_points.pkl')
+    counts.clear()
+    mark_dirty('user_points.json')
 
 async def weekly_recap(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     if not weekly_messages:
         return
     
-    sorted_chatters = sorted(weekly_messages.items(), key=lambda x: x[1], reverse=True)[:3]
-    recap = "📢 Savaitės Pokalbių Karaliai 📢\n"
+    sorted_chatters = heapq.nlargest(3, weekly_messages.items(), key=lambda x: x[1])
+    lines = ["📢 Savaitės Pokalbių Karaliai 📢\n"]
     for user_id, msg_count in sorted_chatters:
-        try:
-            username = next(k for k, v in username_to_id.items() if v == user_id)
-            recap += f"{username}: {msg_count} žinučių\n"
-        except StopIteration:
-            recap += f"User {user_id}: {msg_count} žinučių\n"
+        lines.append(f"{id_to_username.get(user_id, f'User {user_id}')}: {msg_count} žinučių\n")
     
-    await context.bot.send_message(GROUP_CHAT_ID, recap)
+    await send(lambda: context.bot.send_message(GROUP_ID, ''.join(lines)), GROUP_ID)
     weekly_messages.clear()
 
+@group_only
 async def coinflip(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        return
     initiator_id = update.message.from_user.id
-    try:
-        amount = int(context.args[0])
-        opponent = context.args[1]
-        
-        if amount <= 0 or user_points[initiator_id] < amount:
-            msg = await update.message.reply_text("Netinkama suma arba trūksta taškų!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-            return
-        
-        initiator_member = await context.bot.get_chat_member(chat_id, initiator_id)
-        initiator_username = f"@{initiator_member.user.username}" if initiator_member.user.username else f"@User{initiator_id}"
+    amount = None
+    if len(context.args) >= 2:
+        try:
+            amount = int(context.args[0])
+        except ValueError:
+            pass
+    if amount is None:
+        await reply_ephemeral(update, "Naudok: /coinflip Amount @Username")
+        return
+    opponent = context.args[1]
+    
+    if amount <= 0 or user_points[initiator_id] < amount:
+        await reply_ephemeral(update, "Netinkama suma arba trūksta taškų!")
+        return
+    
+    initiator = update.message.from_user
+    initiator_username = f"@{initiator.username}" if initiator.username else f"@User{initiator_id}"
 
-        target_id = username_to_id.get(opponent.lower(), None)
-        if not target_id or opponent == initiator_username:
-            msg = await update.message.reply_text("Negalima mesti iššūkio sau ar neegzistuojančiam vartotojui!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-            return
-        
-        opponent_tag = opponent
-        if user_points[target_id] < amount:
-            msg = await update.message.reply_text(f"{opponent_tag} neturi pakankamai taškų!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-            return
-        
-        coinflip_challenges[target_id] = (initiator_id, amount, datetime.now(TIMEZONE), initiator_username, opponent_tag, chat_id)
-        msg = await update.message.reply_text(f"{initiator_username} iššaukė {opponent_tag} monetos metimui už {amount} taškų! Priimk su /accept_coinflip!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        context.job_queue.run_once(expire_challenge, 300, context=(target_id, context))
-    except (IndexError, ValueError):
-        msg = await update.message.reply_text("Naudok: /coinflip Amount @Username")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    opponent_lower = opponent.lower()
+    target_id = username_to_id.get(opponent_lower)
+    if not target_id or opponent_lower == initiator_username.lower():
+        await reply_ephemeral(update, "Negalima mesti iššūkio sau ar neegzistuojančiam vartotojui!")
+        return
+    
+    opponent_tag = opponent
+    if user_points[target_id] < amount:
+        await reply_ephemeral(update, f"{opponent_tag} neturi pakankamai taškų!")
+        return
+    
+    if target_id in coinflip_challenges:
+        await reply_ephemeral(update, f"{opponent_tag} jau turi aktyvų iššūkį!")
+        return
+    
+    coinflip_challenges[target_id] = (initiator_id, amount, datetime.now(TIMEZONE), initiator_username, opponent_tag, chat_id)
+    await reply_ephemeral(update, f"{initiator_username} iššaukė {opponent_tag} monetos metimui už {amount} taškų! Priimk su /accept_coinflip!")
 
 async def accept_coinflip(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
-    if user_id not in coinflip_challenges:
-        msg = await update.message.reply_text("Nėra aktyvaus iššūkio!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    # Pop before the first await so a concurrent /accept_coinflip cannot settle the same challenge twice
+    challenge = coinflip_challenges.pop(user_id, None)
+    if challenge is None:
+        await reply_ephemeral(update, "Nėra aktyvaus iššūkio!")
         return
-    initiator_id, amount, timestamp, initiator_username, opponent_username, original_chat_id = coinflip_challenges[user_id]
+    initiator_id, amount, timestamp, initiator_username, opponent_username, original_chat_id = challenge
     now = datetime.now(TIMEZONE)
     if now - timestamp > timedelta(minutes=5) or chat_id != original_chat_id:
-        del coinflip_challenges[user_id]
-        msg = await update.message.reply_text("Iššūkis pasibaigė arba neteisinga grupė!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Iššūkis pasibaigė arba neteisinga grupė!")
         return
     result = random.choice([initiator_id, user_id])
-    await context.bot.send_sticker(chat_id=chat_id, sticker=COINFLIP_STICKER_ID)
+    await send(lambda: context.bot.send_sticker(chat_id=chat_id, sticker=COINFLIP_STICKER_ID), chat_id)
     if result == initiator_id:
         user_points[initiator_id] += amount
         user_points[user_id] -= amount
-        msg = await update.message.reply_text(f"🪙 {initiator_username} laimėjo {amount} taškų prieš {opponent_username}!")
+        await reply_ephemeral(update, f"🪙 {initiator_username} laimėjo {amount} taškų prieš {opponent_username}!")
     else:
         user_points[user_id] += amount
         user_points[initiator_id] -= amount
-        msg = await update.message.reply_text(f"🪙 {opponent_username} laimėjo {amount} taškų prieš {initiator_username}!")
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-    del coinflip_challenges[user_id]
-    save_data(user_points, 'user_points.pkl')
-
-async def expire_challenge(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    opponent_id, ctx = context.job.context
-    if opponent_id in coinflip_challenges:
-        _, amount, _, initiator_username, opponent_username, chat_id = coinflip_challenges[opponent_id]
-        del coinflip_challenges[opponent_id]
-        msg = await ctx.bot.send_message(chat_id, f"Iššūkis tarp {initiator_username} ir {opponent_username} už {amount} taškų pasibaigė!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, f"🪙 {opponent_username} laimėjo {amount} taškų prieš {initiator_username}!")
+    mark_dirty('user_points.json')
+
+async def sweep_challenges(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    cutoff = datetime.now(TIMEZONE) - timedelta(minutes=5)
+    expired = []
+    while coinflip_challenges and next(iter(coinflip_challenges.values()))[2] <= cutoff:
+        expired.append(coinflip_challenges.popitem(last=False)[1])
+    for _, amount, _, initiator_username, opponent_username, chat_id in expired:
+        msg = await send(lambda: context.bot.send_message(chat_id, f"Iššūkis tarp {initiator_username} ir {opponent_username} už {amount} taškų pasibaigė!"), chat_id)
+        schedule_delete(chat_id, msg.message_id)
 
 async def addpoints(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali pridėti taškus!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali pridėti taškus!")
         return
-    try:
-        amount = int(context.args[0])
-        target = context.args[1]
-        target_id = int(target.strip('@User'))
-        user_points[target_id] += amount
-        msg = await update.message.reply_text(f"Pridėta {amount} taškų @User{target_id}! Dabar: {user_points[target_id]}")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        save_data(user_points, 'user_points.pkl')
-    except (IndexError, ValueError):
-        msg = await update.message.reply_text("Naudok: /addpoints Amount @UserID")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    amount = target_id = None
+    if len(context.args) >= 2:
+        try:
+            amount = int(context.args[0])
+            target_id = int(context.args[1].removeprefix('@User'))
+        except ValueError:
+            pass
+    if target_id is None:
+        await reply_ephemeral(update, "Naudok: /addpoints Amount @UserID")
+        return
+    user_points[target_id] += amount
+    await reply_ephemeral(update, f"Pridėta {amount} taškų @User{target_id}! Dabar: {user_points[target_id]}")
+    mark_dirty('user_points.json')
 
 async def pridetitaskus(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.message.from_user.id)
-    chat_id = update.message.chat_id
-    if user_id != ADMIN_CHAT_ID:
-        msg = await update.message.reply_text("Tik adminas gali naudoti šią komandą!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    user_id = update.message.from_user.id
+    if user_id != ADMIN_ID:
+        await reply_ephemeral(update, "Tik adminas gali naudoti šią komandą!")
         return
     try:
         seller = context.args[0]
@@ -944,82 +1234,136 @@ async def pridetitaskus(update: telegram.Update, context: telegram.ext.ContextTy
             seller = '@' + seller  # Normalize by adding '@'
         amount = int(context.args[1])
         if seller not in trusted_sellers:
-            msg = await update.message.reply_text(f"{seller} nėra patikimų pardavėjų sąraše!")
-            context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+            await reply_ephemeral(update, f"{seller} nėra patikimų pardavėjų sąraše!")
             return
         votes_alltime[seller] += amount
-        msg = await update.message.reply_text(f"Pridėta {amount} taškų {seller} visų laikų balsams. Dabar: {votes_alltime[seller]}")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        save_data(votes_alltime, 'votes_alltime.pkl')
+        await reply_ephemeral(update, f"Pridėta {amount} taškų {seller} visų laikų balsams. Dabar: {votes_alltime[seller]}")
+        invalidate_barygos()
+        mark_dirty('votes_alltime.pkl')
     except (IndexError, ValueError):
-        msg = await update.message.reply_text("Naudok: /pridetitaskus @Seller Amount")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+        await reply_ephemeral(update, "Naudok: /pridetitaskus @Seller Amount")
 
+@group_only
 async def points(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
     logger.info(f"/points called by user_id={user_id} in chat_id={chat_id}")
 
-    if not is_allowed_group(chat_id):
-        msg = await update.message.reply_text("Botas neveikia šioje grupėje!")
-        context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
-        logger.warning(f"Chat_id={chat_id} not in allowed_groups={allowed_groups}")
-        return
-
     points = user_points.get(user_id, 0)
     streak = chat_streaks.get(user_id, 0)
-    msg = await update.message.reply_text(f"Jūsų taškai: {points}\nSerija: {streak} dienų")
-    context.job_queue.run_once(delete_message_job, 45, context=(chat_id, msg.message_id))
+    await reply_ephemeral(update, f"Jūsų taškai: {points}\nSerija: {streak} dienų")
     logger.info(f"Points for user_id={user_id}: {points}, Streak: {streak}")
 
+async def sweep_monthly_votes(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    now = datetime.now(TIMEZONE)
+    cutoff = now - _MONTH
+    pruned = False
+    for vendor in votes_monthly:
+        pruned |= prune_monthly(vendor, cutoff)
+    if pruned:
+        invalidate_barygos()
+        mark_dirty('votes_monthly.pkl')
+    history_cutoff = now - _HISTORY_RETENTION
+    pruned = False
+    for history in vote_history.values():
+        pruned |= history.prune(history_cutoff)
+    if pruned:
+        mark_dirty('vote_history.pkl')
+
+async def sweep_stale_state(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    now = datetime.now(TIMEZONE)
+    poll_cutoff = (now - timedelta(days=1)).timestamp()
+    for poll_id in [pid for pid in polls if int(pid.rsplit("_", 1)[1]) < poll_cutoff]:
+        del polls[poll_id]
+    for cid in [cid for cid, complaint in pending_downvotes.items() if now - complaint.ts > _WEEK]:
+        del pending_downvotes[cid]
+    # Approved complaints feed the 30-day downvote count in /pardavejoinfo
+    for cid in [cid for cid, complaint in approved_downvotes.items() if now - complaint.ts > _MONTH]:
+        del approved_downvotes[cid]
+    # A cooldown entry older than the cooldown itself behaves exactly like a missing one
+    for attempts, cooldown in ((last_vote_attempt, _VOTE_COOLDOWN), (last_downvote_attempt, _DOWNVOTE_COOLDOWN)):
+        for uid in [uid for uid, ts in attempts.items() if now - ts >= cooldown]:
+            del attempts[uid]
+
 async def reset_votes(context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
-    global votes_weekly, voters, downvoters, pending_downvotes, complaint_id, last_vote_attempt
+    global complaint_id
     votes_weekly.clear()
-    voters.clear()
-    downvoters.clear()
     pending_downvotes.clear()
     last_vote_attempt.clear()
     complaint_id = 0
-    await context.bot.send_message(GROUP_CHAT_ID, "Nauja balsavimo savaitė prasidėjo!")
-    save_data(votes_weekly, 'votes_weekly.pkl')
+    await send(lambda: context.bot.send_message(GROUP_ID, "Nauja balsavimo savaitė prasidėjo!"), GROUP_ID)
+    invalidate_barygos()
+    mark_dirty('votes_weekly.pkl')
+
+_CALLBACK_HANDLERS = {
+    'vote': handle_vote_button,
+    'poll': handle_poll_button,
+    'admin': handle_admin_button,
+}
+
+async def handle_callback(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    handler = _CALLBACK_HANDLERS.get(update.callback_query.data.split('_', 1)[0])
+    if handler is not None:
+        await handler(update, context)
+
+COMMANDS = {
+    'startas': startas,
+    'activate_group': activate_group,
+    'nepatiko': nepatiko,
+    'approve': approve,
+    'addseller': addseller,
+    'removeseller': removeseller,
+    'pardavejoinfo': sellerinfo,
+    'barygos': barygos,
+    'balsuoju': balsuoju,
+    'chatking': chatking,
+    'coinflip': coinflip,
+    'accept_coinflip': accept_coinflip,
+    'addpoints': addpoints,
+    'pridetitaskus': pridetitaskus,
+    'points': points,
+    'debug': debug,
+    'whoami': whoami,
+    'addftbaryga': addftbaryga,
+    'addftbaryga2': addftbaryga2,
+    'editpardavejai': editpardavejai,
+    'apklausa': apklausa,
+    'privatus': privatus,
+}
+
+# One CommandHandler for every command above: PTB matches the name against a set, then the dict picks the callback
+async def handle_command(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE) -> None:
+    # Slice by the bot_command entity like CommandHandler does, so '/points!' resolves to 'points'
+    command = update.message.text[1:update.message.entities[0].length].split('@', 1)[0].lower()
+    await COMMANDS[command](update, context)
 
 # Add handlers
-application.add_handler(CommandHandler(['startas'], startas))
-application.add_handler(CommandHandler(['activate_group'], activate_group))
-application.add_handler(CommandHandler(['nepatiko'], nepatiko))
-application.add_handler(CommandHandler(['approve'], approve))
-application.add_handler(CommandHandler(['addseller'], addseller))
-application.add_handler(CommandHandler(['removeseller'], removeseller))
-application.add_handler(CommandHandler(['pardavejoinfo'], sellerinfo))
-application.add_handler(CommandHandler(['barygos'], barygos))
-application.add_handler(CommandHandler(['balsuoju'], balsuoju))
-application.add_handler(CommandHandler(['chatking'], chatking))
-application.add_handler(CommandHandler(['coinflip'], coinflip))
-application.add_handler(CommandHandler(['accept_coinflip'], accept_coinflip))
-application.add_handler(CommandHandler(['addpoints'], addpoints))
-application.add_handler(CommandHandler(['pridetitaskus'], pridetitaskus))
-application.add_handler(CommandHandler(['points'], points))
-application.add_handler(CommandHandler(['debug'], debug))
-application.add_handler(CommandHandler(['whoami'], whoami))
-application.add_handler(CommandHandler(['addftbaryga'], addftbaryga))
-application.add_handler(CommandHandler(['addftbaryga2'], addftbaryga2))
-application.add_handler(CommandHandler(['editpardavejai'], editpardavejai))
-application.add_handler(CommandHandler(['apklausa'], apklausa))
-application.add_handler(CommandHandler(['privatus'], privatus))
-application.add_handler(MessageHandler(filters.Regex('^/start$') & filters.ChatType.PRIVATE, start_private))
-application.add_handler(CallbackQueryHandler(handle_vote_button, pattern="vote_"))
-application.add_handler(CallbackQueryHandler(handle_poll_button, pattern="poll_"))
-application.add_handler(CallbackQueryHandler(handle_admin_button, pattern="admin_"))
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-
-# Schedule jobs
-application.job_queue.run_daily(award_daily_points, time=time(hour=0, minute=0))
-application.job_queue.scheduler.add_job(
-    weekly_recap, CronTrigger(day_of_week='sun', hour=23, minute=0, timezone=TIMEZONE), args=[application], id='weekly_recap'
-)
-application.job_queue.scheduler.add_job(
-    reset_votes, CronTrigger(day_of_week='mon', hour=0, minute=0, timezone=TIMEZONE), args=[application], id='reset_votes_weekly'
-)
+application.add_handlers([
+    CommandHandler(list(COMMANDS), handle_command),
+    CommandHandler(['start'], start_private, filters=filters.ChatType.PRIVATE),
+    CallbackQueryHandler(handle_callback, block=False),
+    MessageHandler(filters.UpdateType.MESSAGE & allowed_chats_filter & filters.TEXT & ~filters.COMMAND, handle_message),
+])
+
+# Schedule jobs: called from configure_scheduler once our scheduler has replaced PTB's, since jobs added
+# to PTB's scheduler before the swap stay on it and it is never started
+def schedule_jobs(application):
+    application.job_queue.run_daily(award_daily_points, time=time(hour=0, minute=0, tzinfo=TIMEZONE))
+    application.job_queue.run_repeating(sweep_deletes, interval=5)
+    application.job_queue.run_repeating(sweep_challenges, interval=30)
+    application.job_queue.scheduler.add_job(
+        weekly_recap, CronTrigger(day_of_week='sun', hour=23, minute=0, timezone=TIMEZONE), args=[application], id='weekly_recap'
+    )
+    application.job_queue.scheduler.add_job(
+        reset_votes, CronTrigger(day_of_week='mon', hour=0, minute=0, timezone=TIMEZONE), args=[application], id='reset_votes_weekly'
+    )
+    application.job_queue.scheduler.add_job(
+        sweep_stale_state, CronTrigger(minute=0, timezone=TIMEZONE), args=[application], id='sweep_stale_state'
+    )
+    application.job_queue.scheduler.add_job(
+        sweep_monthly_votes, CronTrigger(hour=3, minute=0, timezone=TIMEZONE), args=[application], id='sweep_monthly_votes'
+    )
+
 
 if __name__ == '__main__':
     try: